@@ -38,15 +38,12 @@ else:
 
 print()
 
-# Check 2: List all running containers
-print("2. Listing all running containers...")
-returncode, stdout, stderr = run_cmd(["docker", "ps", "--format", "{{.Names}}"])
+# Check 2: List running ESPHome containers (filtered by the Docker daemon)
+print("2. Listing running ESPHome containers...")
+returncode, stdout, stderr = run_cmd(["docker", "ps", "--filter", "name=esphome", "--format", "{{.Names}}"])
 if returncode == 0:
-    containers = stdout.strip().split('\n')
-    print(f"   Found {len(containers)} running containers:")
-    for container in containers:
-        if container:
-            print(f"     - {container}")
+    esphome_containers = stdout.split()
+    print(f"   Found {len(esphome_containers)} running ESPHome containers")
 else:
     print(f"   ✗ Failed to list containers: {stderr}")
     exit(1)
@@ -55,7 +52,6 @@ print()
 
 # Check 3: Find ESPHome container
 print("3. Looking for ESPHome container...")
-esphome_containers = [c for c in containers if 'esphome' in c.lower()]
 if esphome_containers:
     print(f"   ✓ Found ESPHome container(s):")
     for container in esphome_containers:
@@ -107,14 +103,20 @@ print()
 
 # Check 7: Check if /config/esphome directory exists
 print("7. Checking /config/esphome directory...")
-returncode, stdout, stderr = run_cmd(["docker", "exec", esphome_container, "ls", "/config/esphome"])
+# Count and sample the YAML files inside the container (prints up to 5 names, then the count)
+returncode, stdout, stderr = run_cmd([
+    "docker", "exec", esphome_container, "sh", "-c",
+    "cd /config/esphome || exit 1; ls -1 | awk '/\\.yaml$/ { n++; if (n <= 5) print } END { print n + 0 }'"
+])
 if returncode == 0:
-    yaml_files = [f for f in stdout.strip().split('\n') if f.endswith('.yaml')]
+    lines = stdout.strip().split('\n')
+    yaml_count = int(lines[-1]) if lines[-1].isdigit() else 0
+    yaml_files = lines[:-1]
     print(f"   ✓ /config/esphome directory exists")
-    print(f"   Found {len(yaml_files)} YAML files")
+    print(f"   Found {yaml_count} YAML files")
     if yaml_files:
         print(f"   First few YAML files:")
-        for f in yaml_files[:5]:
+        for f in yaml_files:
             print(f"     - {f}")
 else:
     print(f"   ✗ /config/esphome directory not accessible: {stderr}")
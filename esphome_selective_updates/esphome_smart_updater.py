@@ -10,9 +10,18 @@ import json
 import subprocess
 import time
 import re
+import atexit
+import signal
+import socket
+import collections
+import functools
+import hashlib
+import http.client
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait as wait_for_futures
 from pathlib import Path
-from datetime import datetime, timezone
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Deque, Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
 
 # ============================================================================
 # PATHS & CONSTANTS
@@ -24,6 +33,10 @@ DASHBOARD_FILE = ESPHOME_DIR / ".esphome" / "dashboard.json"
 STATE_FILE = CONFIG_DIR / "esphome_smart_update_state.json"
 PROGRESS_FILE = CONFIG_DIR / "esphome_smart_update_progress.json"
 LOG_FILE = CONFIG_DIR / "esphome_smart_update.log"
+YAML_CACHE_FILE = CONFIG_DIR / "esphome_smart_update_yaml_cache.json"
+
+# ESPHome add-on container (found and exported by run.sh, checked at startup by main())
+ESPHOME_CONTAINER = os.environ.get("ESPHOME_CONTAINER", "")
 
 DEFAULTS = {
     "mode": "normal",
@@ -45,6 +58,11 @@ DEFAULTS = {
     "log_level": "normal",
     "repair_dashboard_metadata": False,
     "repair_skip_existing_metadata": True,
+    "repair_concurrency": 2,
+    "skip_offline_devices": False,
+    "update_concurrency": 1,
+    "skip_compile_when_binary_current": False,
+    "skip_upload_when_unchanged": False,
     "debug_test_single_device": "",  # Set to device name to test just one device
 }
 
@@ -57,13 +75,27 @@ LOG_LEVEL_MAP = {
 }
 CURRENT_LOG_LEVEL = 1  # Default to normal
 
+# Serializes log output when devices are compiled in parallel
+_log_lock = threading.Lock()
+
+# Log file handle, opened once on first use and kept for the whole run
+_log_fh = None
+_log_fh_failed = False
+
 # ============================================================================
 # LOGGING UTILITIES
 # ============================================================================
 
+# (second, formatted) - only reformatted when the wall-clock second changes
+_ts_cache: Tuple[int, str] = (-1, "")
+
 def ts() -> str:
     """Generate timestamp for logging"""
-    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
+    global _ts_cache
+    now = int(time.time())
+    if now != _ts_cache[0]:
+        _ts_cache = (now, time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime(now)))
+    return _ts_cache[1]
 
 def set_log_level(level: str):
     """Set the current log level"""
@@ -75,21 +107,57 @@ def should_log(level: str = "normal") -> bool:
     msg_level = LOG_LEVEL_MAP.get(level.lower(), 1)
     return msg_level <= CURRENT_LOG_LEVEL
 
+def _get_log_file():
+    """Open the log file for appending on first use (None if it can't be opened)"""
+    global _log_fh, _log_fh_failed
+    if _log_fh is None and not _log_fh_failed:
+        try:
+            LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+            _log_fh = LOG_FILE.open("a", encoding="utf-8", buffering=8192)
+            atexit.register(close_log_file)
+        except Exception:
+            _log_fh_failed = True
+    return _log_fh
+
+def flush_log_file():
+    """Push buffered log lines to disk"""
+    with _log_lock:
+        if _log_fh is not None:
+            try:
+                _log_fh.flush()
+            except Exception:
+                pass
+
+def close_log_file():
+    """Flush and close the log file (registered with atexit)"""
+    global _log_fh
+    with _log_lock:
+        if _log_fh is not None:
+            try:
+                _log_fh.close()
+            except Exception:
+                pass
+            _log_fh = None
+
 def log(msg: str, level: str = "normal"):
     """Log message to both stdout and file"""
     line = f"{ts()} {msg}"
     
-    # Always log to file (full history)
-    try:
-        LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
-        with LOG_FILE.open("a", encoding="utf-8") as f:
-            f.write(line + "\n")
-    except Exception:
-        pass
-    
-    # Only log to stdout if level permits
-    if should_log(level):
-        print(line, flush=True)
+    with _log_lock:
+        # Always log to file (full history)
+        log_fh = _get_log_file()
+        if log_fh is not None:
+            try:
+                log_fh.write(line + "\n")
+                # Quiet-level lines are headers, errors and warnings: get them on disk now
+                if level == "quiet":
+                    log_fh.flush()
+            except Exception:
+                pass
+        
+        # Only log to stdout if level permits
+        if should_log(level):
+            print(line, flush=True)
 
 def log_quiet(msg: str):
     """Log message at quiet level (always shown)"""
@@ -119,6 +187,9 @@ def truncate_file(path: Path) -> bool:
     Clear a file's contents
     Returns: True if successful, False otherwise
     """
+    if path == LOG_FILE:
+        # Don't let buffered lines land in the file after it's been cleared
+        flush_log_file()
     try:
         path.parent.mkdir(parents=True, exist_ok=True)
         with path.open("w", encoding="utf-8") as f:
@@ -128,6 +199,19 @@ def truncate_file(path: Path) -> bool:
         print(f"ERROR: Failed to truncate {path}: {e}", file=sys.stderr)
         return False
 
+def atomic_write_json(path: Path, obj):
+    """
+    Write JSON to a temp file and rename it over path, so an interrupted
+    write never leaves a truncated file behind (raises on failure)
+    There is no fsync: state, progress and the YAML cache are best-effort,
+    and losing the last write to a power cut only means redoing some work.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_suffix(path.suffix + ".tmp")
+    with tmp_file.open("w", encoding="utf-8") as f:
+        json.dump(obj, f, separators=(",", ":"))
+    os.replace(tmp_file, path)
+
 # ============================================================================
 # CONFIGURATION & STATE MANAGEMENT
 # ============================================================================
@@ -146,46 +230,115 @@ def load_options() -> Dict:
         log_quiet(f"Warning: failed to load options: {e}")
         return DEFAULTS.copy()
 
-def load_state() -> Dict:
-    """Load persistent state"""
-    if not STATE_FILE.exists():
-        return {}
+class StateStore(dict):
+    """
+    Persistent state that remembers whether it changed, so STATE_FILE is
+    only rewritten when there is something new to save
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._dirty = False
+    
+    def __setitem__(self, key, value):
+        if key not in self or self[key] != value:
+            super().__setitem__(key, value)
+            self._dirty = True
+    
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._dirty = True
+    
+    def flush(self):
+        """Write the state to disk if it changed since the last flush"""
+        if self._dirty:
+            save_state(self)
+            self._dirty = False
+
+def load_state() -> StateStore:
+    """Load persistent state (empty if missing or unreadable)"""
     try:
         with STATE_FILE.open("r", encoding="utf-8") as f:
-            return json.load(f)
+            return StateStore(json.load(f))
     except Exception:
-        return {}
+        return StateStore()
 
 def save_state(state: Dict):
     """Save persistent state"""
     try:
-        STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
-        with STATE_FILE.open("w", encoding="utf-8") as f:
-            json.dump(state, f, indent=2)
+        atomic_write_json(STATE_FILE, state)
     except Exception as e:
         log_quiet(f"Warning: failed to save state: {e}")
 
 def load_progress() -> Dict:
-    """Load progress tracking"""
-    if not PROGRESS_FILE.exists():
-        return {"done": [], "failed": [], "skipped": []}
+    """Load progress tracking (empty if missing or unreadable)"""
     try:
         with PROGRESS_FILE.open("r", encoding="utf-8") as f:
             return json.load(f)
     except Exception:
         return {"done": [], "failed": [], "skipped": []}
 
-def save_progress(progress: Dict):
-    """Save progress tracking"""
-    try:
-        PROGRESS_FILE.parent.mkdir(parents=True, exist_ok=True)
-        with PROGRESS_FILE.open("w", encoding="utf-8") as f:
-            json.dump(progress, f, indent=2)
-    except Exception as e:
-        log_quiet(f"Warning: failed to save progress: {e}")
+# Progress writes are batched: at most one every few seconds or every few devices.
+# A deferred write is picked up by a timer, so a quiet spell (e.g. a long
+# compile) never leaves finished devices unsaved for long.
+PROGRESS_SAVE_INTERVAL = 5.0
+PROGRESS_SAVE_EVERY = 10
+_pending_progress: Optional[Dict] = None
+_progress_unsaved = 0
+_progress_last_save = 0.0
+_progress_timer: Optional[threading.Timer] = None
+_progress_io_lock = threading.RLock()
+
+def save_progress(progress: Dict, force: bool = False):
+    """
+    Save progress tracking (batched unless force=True; flush_progress() writes the rest)
+    Call with the workers' progress lock held: a snapshot is taken here, so the
+    timer thread never serializes lists and dicts that workers are changing
+    """
+    global _pending_progress, _progress_unsaved, _progress_timer
+    snapshot = {key: value.copy() if isinstance(value, (list, dict)) else value
+                for key, value in progress.items()}
+    with _progress_io_lock:
+        _pending_progress = snapshot
+        _progress_unsaved += 1
+        wait = PROGRESS_SAVE_INTERVAL - (time.monotonic() - _progress_last_save)
+        if force or _progress_unsaved >= PROGRESS_SAVE_EVERY or wait <= 0:
+            flush_progress()
+        elif _progress_timer is None:
+            _progress_timer = threading.Timer(wait, flush_progress)
+            _progress_timer.daemon = True
+            _progress_timer.start()
+
+def flush_progress():
+    """Write any batched progress to disk"""
+    global _pending_progress, _progress_unsaved, _progress_last_save, _progress_timer
+    with _progress_io_lock:
+        if _progress_timer is not None:
+            _progress_timer.cancel()
+            _progress_timer = None
+        if _pending_progress is None:
+            return
+        try:
+            atomic_write_json(PROGRESS_FILE, _pending_progress)
+        except Exception as e:
+            log_quiet(f"Warning: failed to save progress: {e}")
+        _pending_progress = None
+        _progress_unsaved = 0
+        _progress_last_save = time.monotonic()
 
-def perform_housekeeping(opts: Dict, state: Dict, progress: Dict) -> Dict:
-    """Handle log and progress file cleanup"""
+def cleared_progress(progress: Dict) -> Dict:
+    """
+    Empty progress for a fresh pass over all devices
+    Upload digests (skip_upload_when_unchanged) are kept: a cleared pass is
+    exactly when they are needed to tell unchanged firmware apart
+    """
+    cleared = {"done": [], "failed": [], "skipped": []}
+    if progress.get("hashes"):
+        cleared["hashes"] = progress["hashes"]
+    return cleared
+
+def perform_housekeeping(opts: Dict, state: StateStore, progress: Dict) -> Dict:
+    """Handle log and progress file cleanup (state is written once, at the end)"""
     addon_version = os.environ.get("ADDON_VERSION", "unknown")
     
     # Version change detection
@@ -195,7 +348,6 @@ def perform_housekeeping(opts: Dict, state: Dict, progress: Dict) -> Dict:
                 log_normal(f"Add-on version changed: {state.get('last_version')} → {addon_version}")
                 log_normal("Log file cleared due to version change")
             state["last_version"] = addon_version
-            save_state(state)
     
     # Log clearing confirmation (run.sh handles the actual clearing)
     if opts.get("clear_log_on_start", False):
@@ -205,80 +357,152 @@ def perform_housekeeping(opts: Dict, state: Dict, progress: Dict) -> Dict:
     if bool(opts.get("clear_log_now", False)) and not state.get("clear_log_now_consumed", False):
         log_normal("Log file was cleared (clear_log_now trigger)")
         state["clear_log_now_consumed"] = True
-        save_state(state)
     elif not bool(opts.get("clear_log_now", False)) and state.get("clear_log_now_consumed", False):
         state["clear_log_now_consumed"] = False
-        save_state(state)
     
     # Progress clearing
     if opts.get("clear_progress_on_start", False):
         if truncate_file(PROGRESS_FILE):
-            progress = {"done": [], "failed": [], "skipped": []}
-            save_progress(progress)
+            progress = cleared_progress(progress)
+            save_progress(progress, force=True)
             log_normal("Progress file cleared (clear_progress_on_start)")
     
     if bool(opts.get("clear_progress_now", False)) and not state.get("clear_progress_now_consumed", False):
         if truncate_file(PROGRESS_FILE):
-            progress = {"done": [], "failed": [], "skipped": []}
-            save_progress(progress)
+            progress = cleared_progress(progress)
+            save_progress(progress, force=True)
             log_normal("Progress file cleared (clear_progress_now trigger)")
         state["clear_progress_now_consumed"] = True
-        save_state(state)
     elif not bool(opts.get("clear_progress_now", False)) and state.get("clear_progress_now_consumed", False):
         state["clear_progress_now_consumed"] = False
-        save_state(state)
     
+    state.flush()
     return progress
 
 # ============================================================================
 # SAFETY CHECKS
 # ============================================================================
 
+def iter_yaml_entries() -> Iterator[os.DirEntry]:
+    """
+    Yield directory entries for the top-level *.yaml files in ESPHOME_DIR
+    os.scandir() gives us the name and file type without an extra stat per entry
+    """
+    with os.scandir(ESPHOME_DIR) as it:
+        for entry in it:
+            if entry.name.endswith(".yaml") and entry.is_file(follow_symlinks=False):
+                yield entry
+
 def verify_safe_operation() -> bool:
     """Verify the add-on can operate safely"""
     if not ESPHOME_DIR.exists():
         log_quiet(f"ERROR: ESPHome directory not found: {ESPHOME_DIR}")
         return False
     
-    yaml_files = list(ESPHOME_DIR.glob("*.yaml"))
-    if not yaml_files:
+    if next(iter_yaml_entries(), None) is None:
         log_quiet(f"ERROR: No .yaml files found in {ESPHOME_DIR}")
         return False
     
-    log_debug(f"Found {len(yaml_files)} YAML files in {ESPHOME_DIR}")
+    log_debug(f"Found YAML files in {ESPHOME_DIR}")
     return True
 
 # ============================================================================
 # DASHBOARD.JSON INTERACTION
 # ============================================================================
 
+# Parsed dashboard.json, reused until the file's mtime changes
+_dashboard_cache: Optional[Dict] = None
+_dashboard_mtime: Optional[int] = None
+_dashboard_index: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+
+# Parsed storage files: yaml_name -> (mtime_ns, (deployed_version, current_version))
+_storage_cache: Dict[str, Tuple[int, Tuple[Optional[str], Optional[str]]]] = {}
+
+def invalidate_dashboard_cache(yaml_name: Optional[str] = None):
+    """
+    Drop cached dashboard.json (and storage file) contents so the next read
+    goes back to disk. Called after ESPHome has written to them.
+    """
+    global _dashboard_cache, _dashboard_mtime
+    _dashboard_cache = None
+    _dashboard_mtime = None
+    _dashboard_index.clear()
+    if yaml_name is None:
+        _storage_cache.clear()
+    else:
+        _storage_cache.pop(yaml_name, None)
+
+def _index_dashboard(data: Dict):
+    """Rebuild the name -> (deployed, current) index from parsed dashboard data"""
+    _dashboard_index.clear()
+    for device in data.get("devices", []):
+        name = device.get("name")
+        if name:
+            _dashboard_index[name] = (device.get("deployed_version"), device.get("current_version"))
+
 def read_dashboard_json() -> Dict:
-    """Read the ESPHome dashboard.json file"""
-    if not DASHBOARD_FILE.exists():
+    """
+    Read the ESPHome dashboard.json file
+    The parsed result is cached and only re-read when the file's mtime changes
+    """
+    global _dashboard_cache, _dashboard_mtime
+    try:
+        mtime = DASHBOARD_FILE.stat().st_mtime_ns
+    except FileNotFoundError:
         log_debug(f"Dashboard file not found: {DASHBOARD_FILE}")
         return {}
+    except Exception as e:
+        log_debug(f"Error reading dashboard.json: {e}")
+        return {}
+    
+    if _dashboard_cache is not None and mtime == _dashboard_mtime:
+        return _dashboard_cache
     
     try:
         with DASHBOARD_FILE.open("r", encoding="utf-8") as f:
             data = json.load(f)
-        return data
     except Exception as e:
         log_debug(f"Error reading dashboard.json: {e}")
         return {}
+    
+    _dashboard_cache = data
+    _dashboard_mtime = mtime
+    _index_dashboard(data)
+    return data
+
+def find_device_in_dashboard(device_name: str) -> Optional[Tuple[Optional[str], Optional[str]]]:
+    """
+    Look up one device's (deployed_version, current_version) in dashboard.json
+    Served from the mtime-cached index, so repeated lookups don't reparse the file
+    Returns: None if the device has no dashboard.json entry
+    """
+    read_dashboard_json()
+    return _dashboard_index.get(device_name)
 
 def get_dashboard_versions(device_name: str, yaml_name: str) -> Tuple[Optional[str], Optional[str]]:
     """
     Get deployed_version from ESPHome storage
     ESPHome stores device metadata in /config/esphome/.esphome/storage/[yaml-name].json
+    Parsed storage files are cached and only re-read when their mtime changes
     Returns: (deployed_version, current_version)
     """
     # ESPHome uses .esphome/storage directory with [yaml-name].json files
     storage_dir = ESPHOME_DIR / ".esphome" / "storage"
     storage_file = storage_dir / f"{yaml_name}.json"
     
-    if not storage_file.exists():
+    try:
+        mtime = storage_file.stat().st_mtime_ns
+    except FileNotFoundError:
+        _storage_cache.pop(yaml_name, None)
         log_debug(f"No storage file for {yaml_name}")
         return (None, None)
+    except Exception as e:
+        log_debug(f"Error reading storage file for {yaml_name}: {e}")
+        return (None, None)
+    
+    cached = _storage_cache.get(yaml_name)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
     
     try:
         with storage_file.open("r", encoding="utf-8") as f:
@@ -289,6 +513,7 @@ def get_dashboard_versions(device_name: str, yaml_name: str) -> Tuple[Optional[s
         current = data.get("esphome_version")   # Same for current
         
         log_debug(f"Storage file for {yaml_name}: esphome_version={deployed}")
+        _storage_cache[yaml_name] = (mtime, (deployed, current))
         return (deployed, current)
         
     except Exception as e:
@@ -301,45 +526,57 @@ def update_dashboard_metadata(device_name: str, yaml_name: str, version: str) ->
     1. /config/esphome/.esphome/storage/[yaml-name].json (ESPHome's format)
     2. /config/esphome/.esphome/dashboard.json (our tracking)
     
+    Files that already hold this version (e.g. ESPHome's compile just wrote
+    the storage file) are left alone.
+    
     Returns: True if successful, False otherwise
     """
+    global _dashboard_cache, _dashboard_mtime
     success = True
     
     # Update ESPHome storage file (the important one)
     storage_dir = ESPHOME_DIR / ".esphome" / "storage"
     storage_file = storage_dir / f"{yaml_name}.json"
     
-    try:
-        storage_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Read existing storage or create new
-        if storage_file.exists():
-            with storage_file.open("r", encoding="utf-8") as f:
-                storage_data = json.load(f)
-        else:
-            storage_data = {
-                "storage_version": 1,
-                "name": device_name,
-                "comment": "Created by ESPHome Selective Updates"
-            }
-        
-        # Update version
-        storage_data["esphome_version"] = version
-        
-        # Write back
-        with storage_file.open("w", encoding="utf-8") as f:
-            json.dump(storage_data, f, indent=2)
-        
-        log_debug(f"Updated storage file {yaml_name}.json: {version}")
-        
-    except Exception as e:
-        log_debug(f"Failed to update storage file for {yaml_name}: {e}")
-        success = False
+    if get_dashboard_versions(device_name, yaml_name)[0] == version:
+        log_debug(f"Storage file {yaml_name}.json already at {version}")
+    else:
+        try:
+            storage_dir.mkdir(parents=True, exist_ok=True)
+            
+            # Read existing storage or create new
+            try:
+                with storage_file.open("r", encoding="utf-8") as f:
+                    storage_data = json.load(f)
+            except FileNotFoundError:
+                storage_data = {
+                    "storage_version": 1,
+                    "name": device_name,
+                    "comment": "Created by ESPHome Selective Updates"
+                }
+            
+            # Update version
+            storage_data["esphome_version"] = version
+            
+            # Write back
+            with storage_file.open("w", encoding="utf-8") as f:
+                json.dump(storage_data, f, indent=2)
+            _storage_cache[yaml_name] = (storage_file.stat().st_mtime_ns, (version, version))
+            
+            log_debug(f"Updated storage file {yaml_name}.json: {version}")
+            
+        except Exception as e:
+            log_debug(f"Failed to update storage file for {yaml_name}: {e}")
+            invalidate_dashboard_cache(yaml_name)
+            success = False
     
     # Also update dashboard.json for our own tracking
     try:
-        dashboard = read_dashboard_json()
+        if find_device_in_dashboard(device_name) == (version, version):
+            log_debug(f"dashboard.json already at {version} for {device_name}")
+            return success
         
+        dashboard = read_dashboard_json()
         if "devices" not in dashboard:
             dashboard["devices"] = []
         
@@ -362,10 +599,16 @@ def update_dashboard_metadata(device_name: str, yaml_name: str, version: str) ->
         with DASHBOARD_FILE.open("w", encoding="utf-8") as f:
             json.dump(dashboard, f, indent=2)
         
+        # Keep the cache in step with what we just wrote instead of re-parsing it
+        _dashboard_cache = dashboard
+        _dashboard_mtime = DASHBOARD_FILE.stat().st_mtime_ns
+        _dashboard_index[device_name] = (version, version)
+        
         log_debug(f"Updated dashboard.json for {device_name}: {version}")
         
     except Exception as e:
         log_debug(f"Failed to update dashboard.json: {e}")
+        invalidate_dashboard_cache()
         # Don't set success=False - storage file is more important
     
     return success
@@ -374,116 +617,643 @@ def update_dashboard_metadata(device_name: str, yaml_name: str, version: str) ->
 # ESPHOME INTERACTION/COMPILATION
 # ============================================================================
 
-def run_esphome_command(args: List[str], cwd: Optional[Path] = None) -> Tuple[int, str, str]:
+DOCKER_SOCKET = "/run/docker.sock"
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection that talks to the Docker daemon over its unix socket"""
+    
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+    
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+def docker_container_running(name: str) -> Optional[bool]:
     """
-    Execute an ESPHome command via docker exec
-    Returns: (returncode, stdout, stderr)
+    Ask the Docker API whether a container is running, without forking the CLI
+    Returns None if the API can't be reached, so the caller can fall back to docker ps
     """
-    # Get ESPHome container name from environment (set by run.sh)
-    esphome_container = os.environ.get("ESPHOME_CONTAINER", "")
+    conn = _UnixHTTPConnection(DOCKER_SOCKET, timeout=10)
+    try:
+        conn.request("GET", f"/containers/{urllib.parse.quote(name, safe='')}/json")
+        response = conn.getresponse()
+        body = response.read()
+    except (OSError, http.client.HTTPException) as e:
+        log_debug(f"Docker API not reachable on {DOCKER_SOCKET}: {e}")
+        return None
+    finally:
+        conn.close()
+    
+    if response.status == 404:
+        return False
+    if response.status != 200:
+        log_debug(f"Docker API returned HTTP {response.status} for container {name}")
+        return None
+    try:
+        return bool(json.loads(body).get("State", {}).get("Running"))
+    except ValueError:
+        return None
+
+# Small request/response loop run inside the ESPHome container by
+# `docker exec -i <container> python3 -u -c ...`. Each request is one JSON
+# line ({"argv": [...], "timeout": n}). The helper acknowledges it with
+# {"accepted": true}, then streams one JSON line per output line
+# ({"line": "..."}) followed by {"rc": n}.
+HELPER_SOURCE = """
+import json, subprocess, sys, threading
+def send(msg):
+    sys.stdout.write(json.dumps(msg) + "\\n")
+    sys.stdout.flush()
+for req in sys.stdin:
+    req = json.loads(req)
+    send({"accepted": True})
+    try:
+        p = subprocess.Popen(req["argv"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                             text=True, errors="replace", bufsize=1)
+    except Exception as e:
+        send({"line": str(e)})
+        send({"rc": 1})
+        continue
+    timed_out = []
+    timer = threading.Timer(req.get("timeout") or 1800, lambda: (timed_out.append(1), p.kill()))
+    timer.start()
+    for line in p.stdout:
+        send({"line": line.rstrip("\\n")})
+    p.wait()
+    timer.cancel()
+    send({"rc": 124 if timed_out else p.returncode})
+"""
+
+# How much command output is kept in memory for error reporting
+OUTPUT_TAIL_LINES = 500
+MAX_ERROR_LINES = 20
+_ERROR_LINE_RE = re.compile(r"error", re.IGNORECASE)
+_WARNING_LINE_RE = re.compile(r"warning", re.IGNORECASE)
+
+# Known failure markers, matched on every line as the output streams in
+_ERR_RE = re.compile(r"page not found|no such file|connection refused|timeout", re.IGNORECASE)
+
+class CommandResult(NamedTuple):
+    """Outcome of an ESPHome command, with its output already classified"""
+    returncode: int
+    output: str             # last OUTPUT_TAIL_LINES lines of combined stdout/stderr
+    error_lines: List[str]  # first MAX_ERROR_LINES lines mentioning "error"
+    warning_count: int      # number of lines mentioning "warning"
+    markers: FrozenSet[str] = frozenset()  # known failure markers seen anywhere in the output
+
+def find_error_markers(output: str) -> Set[str]:
+    """Return the (lowercased) known failure markers present in output"""
+    return {m.lower() for m in _ERR_RE.findall(output)}
+
+def _timed_out(result: CommandResult, timeout: int) -> CommandResult:
+    """Mark a result as timed out, appending the timeout message to its output"""
+    output = "\n".join(filter(None, [result.output, _timeout_message(timeout)]))
+    return result._replace(returncode=124, output=output)
+
+def collect_output(returncode: int, lines: Iterable[str]) -> CommandResult:
+    """
+    Consume command output one line at a time, keeping only a bounded tail
+    plus the error lines, a warning count and the failure markers seen
+    (full output goes to the debug log)
+    """
+    tail: Deque[str] = collections.deque(maxlen=OUTPUT_TAIL_LINES)
+    error_lines: List[str] = []
+    warning_count = 0
+    markers: Set[str] = set()
+    
+    for line in lines:
+        line = line.rstrip("\n")
+        tail.append(line)
+        log_debug(f"    | {line}")
+        if _ERROR_LINE_RE.search(line):
+            if len(error_lines) < MAX_ERROR_LINES:
+                error_lines.append(line.strip())
+        # Not elif: "warning: unused variable 'error_count'" is still a warning
+        if _WARNING_LINE_RE.search(line):
+            warning_count += 1
+        # Markers can be far from the end of a long output, so don't rely on the tail
+        markers.update(find_error_markers(line))
+    
+    return CommandResult(returncode, "\n".join(tail), error_lines, warning_count, frozenset(markers))
+
+# One helper per thread, so parallel compiles don't share a pipe
+_helper_local = threading.local()
+_helpers: List[subprocess.Popen] = []
+_helpers_lock = threading.Lock()
+# One-off `docker exec` processes currently running (fallback path)
+_exec_procs: Set[subprocess.Popen] = set()
+# Set once running commands have been killed for shutdown; no new ones start
+_commands_stopped = threading.Event()
+
+def _timeout_message(timeout: int) -> str:
+    """Human readable timeout error"""
+    if timeout >= 60:
+        return f"Command timed out after {timeout // 60} minutes"
+    return f"Command timed out after {timeout} seconds"
+
+def stop_helper(helper: subprocess.Popen):
+    """Shut down an in-container helper (closing stdin ends its loop)"""
+    try:
+        helper.stdin.close()
+        helper.wait(timeout=5)
+    except Exception:
+        helper.kill()
+
+def stop_all_helpers():
+    """Shut down every helper started by this process"""
+    with _helpers_lock:
+        helpers = list(_helpers)
+        _helpers.clear()
+    for helper in helpers:
+        stop_helper(helper)
+
+atexit.register(stop_all_helpers)
+
+def kill_running_commands():
+    """
+    Kill every helper and one-off docker exec, so threads waiting on ESPHome
+    output return at once (their commands come back as failed); later commands are refused
+    """
+    _commands_stopped.set()
+    with _helpers_lock:
+        procs = list(_helpers) + list(_exec_procs)
+    for proc in procs:
+        try:
+            proc.kill()
+        except Exception:
+            pass
+
+def start_helper(esphome_container: str) -> Optional[subprocess.Popen]:
+    """
+    Start one long-lived `docker exec -i` into the ESPHome container for the
+    calling thread, so each ESPHome command doesn't pay for a fresh docker exec
+    Returns: the helper process, or None if it can't be started
+    """
+    helper = getattr(_helper_local, "helper", None)
+    if helper is not None and helper.poll() is None:
+        return helper
+    if getattr(_helper_local, "failed", False):
+        return None
     
-    if not esphome_container:
-        error_msg = "ESPHOME_CONTAINER environment variable not set"
-        log_debug(error_msg)
-        return (1, "", error_msg)
+    try:
+        helper = subprocess.Popen(
+            ["docker", "exec", "-i", esphome_container, "python3", "-u", "-c", HELPER_SOURCE],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            bufsize=1
+        )
+    except Exception as e:
+        log_debug(f"Could not start ESPHome helper, using docker exec per command: {e}")
+        _helper_local.failed = True
+        return None
+    
+    _helper_local.helper = helper
+    with _helpers_lock:
+        _helpers.append(helper)
+    log_debug(f"Started ESPHome helper in {esphome_container} (pid {helper.pid})")
+    return helper
+
+def _discard_helper(helper: subprocess.Popen):
+    """Stop using the calling thread's helper; later commands use docker exec"""
+    _helper_local.failed = True
+    _helper_local.helper = None
+    with _helpers_lock:
+        if helper in _helpers:
+            _helpers.remove(helper)
+    stop_helper(helper)
+
+def send_rpc(request: Dict) -> Optional[CommandResult]:
+    """
+    Send one request to the calling thread's helper and stream back its output
+    Returns: the command result, or None if the helper failed before accepting
+    the request (so the caller can safely run it another way)
+    A helper dying after accepting the request returns a failed result instead:
+    the command may already have run, and an upload must not be repeated.
+    """
+    helper = start_helper(ESPHOME_CONTAINER)
+    if helper is None:
+        return None
     
-    # Get the ESPHome command (detected at startup)
-    esphome_cmd = os.environ.get("ESPHOME_COMMAND", "esphome")
+    try:
+        helper.stdin.write(json.dumps(request) + "\n")
+        helper.stdin.flush()
+        ack = helper.stdout.readline()
+        if not ack or not json.loads(ack).get("accepted"):
+            raise RuntimeError("helper did not accept the request")
+    except Exception as e:
+        log_debug(f"ESPHome helper failed, using docker exec per command: {e}")
+        _discard_helper(helper)
+        return None
+    
+    returncode = []
+    
+    def replies() -> Iterator[str]:
+        while True:
+            reply = helper.stdout.readline()
+            try:
+                msg = json.loads(reply) if reply else None
+            except ValueError:
+                msg = None
+            if msg is None:
+                return
+            if "rc" in msg:
+                returncode.append(msg["rc"])
+                return
+            yield msg.get("line", "")
+    
+    result = collect_output(0, replies())
+    if returncode:
+        return result._replace(returncode=returncode[0])
+    
+    error_msg = "ESPHome helper exited during the command"
+    log_debug(error_msg)
+    _discard_helper(helper)
+    return result._replace(
+        returncode=1,
+        output="\n".join(filter(None, [result.output, error_msg])),
+        error_lines=[error_msg] + result.error_lines,
+    )
+
+# Built on first use, after main() has detected ESPHOME_COMMAND
+_esphome_argv: Optional[Tuple[str, ...]] = None
+_DOCKER_EXEC_PREFIX = ("docker", "exec", "-i", ESPHOME_CONTAINER)
+
+def get_esphome_argv() -> Tuple[str, ...]:
+    """Return the argv prefix for running ESPHome inside the container"""
+    global _esphome_argv
+    if _esphome_argv is None:
+        _esphome_argv = tuple(os.environ.get("ESPHOME_COMMAND", "esphome").split())
+    return _esphome_argv
+
+def run_esphome_command(
+    args: List[str],
+    timeout: int = 1800
+) -> CommandResult:
+    """
+    Execute an ESPHome command in the ESPHome container
+    Uses the persistent helper when available, otherwise a one-off docker exec.
+    Output is streamed and classified line by line rather than buffered whole.
+    Returns: CommandResult(returncode, output tail, error lines, warning count, markers)
+    """
+    if _commands_stopped.is_set():
+        error_msg = "Not started: the add-on is stopping"
+        return CommandResult(1, error_msg, [error_msg], 0)
     
-    # Build the docker exec command
-    cmd = [
-        "docker", "exec", "-i",
-        esphome_container,
-    ] + esphome_cmd.split() + args
+    argv = get_esphome_argv() + tuple(args)
+    log_debug(f"Running command: {' '.join(argv)}")
     
-    log_debug(f"Running command: {' '.join(cmd)}")
+    result = send_rpc({"argv": argv, "timeout": timeout})
+    if result is not None:
+        if result.returncode == 124:
+            return _timed_out(result, timeout)
+        return result
+    
+    # Fall back to a one-off docker exec
+    cmd = _DOCKER_EXEC_PREFIX + argv
+    log_debug(f"Running via docker exec: {' '.join(cmd)}")
     
     try:
-        result = subprocess.run(
+        proc = subprocess.Popen(
             cmd,
-            cwd=str(cwd) if cwd else None,
-            capture_output=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
             text=True,
-            timeout=1800  # 30 minute timeout
+            errors="replace",
+            bufsize=1
         )
-        
-        return (result.returncode, result.stdout, result.stderr)
-    except subprocess.TimeoutExpired:
-        return (124, "", "Command timed out after 30 minutes")
     except FileNotFoundError:
-        return (1, "", "Docker command not found - is Docker installed?")
+        error_msg = "Docker command not found - is Docker installed?"
+        return CommandResult(1, error_msg, [error_msg], 0)
     except Exception as e:
-        return (1, "", str(e))
+        return CommandResult(1, str(e), [str(e)], 0, frozenset(find_error_markers(str(e))))
+    
+    timed_out = threading.Event()
+    
+    def on_timeout():
+        timed_out.set()
+        proc.kill()
+    
+    timer = threading.Timer(timeout, on_timeout)  # 30 minute default
+    timer.start()
+    with _helpers_lock:
+        _exec_procs.add(proc)
+    try:
+        result = collect_output(0, proc.stdout)
+        returncode = proc.wait()
+    finally:
+        timer.cancel()
+        with _helpers_lock:
+            _exec_procs.discard(proc)
+    
+    if timed_out.is_set():
+        return _timed_out(result, timeout)
+    return result._replace(returncode=returncode)
+
+# Threads used to stat/read YAML configs, so uncached reads on slow storage overlap
+YAML_READ_WORKERS = 8
 
 def get_esphome_devices() -> List[Dict]:
     """
     Get list of ESPHome devices and their current versions
-    Returns list of dicts with keys: name, config_file, current_version, deployed_version
+    Returns list of dicts with keys: name, config_file, current_version, deployed_version,
+    address, api_port
     """
     devices = []
     
-    yaml_files = sorted(ESPHOME_DIR.glob("*.yaml"))
-    log_verbose(f"Scanning {len(yaml_files)} YAML configuration files...")
+    yaml_names = sorted(entry.name for entry in iter_yaml_entries())
+    log_verbose(f"Scanning {len(yaml_names)} YAML configuration files...")
     
     # Use the ESPHome version detected at startup for all devices
     esphome_version = os.environ.get("ESPHOME_VERSION", "unknown")
     
-    for yaml_path in yaml_files:
-        yaml_name = yaml_path.name
-        
-        # Get device name from YAML
-        device_name = get_device_name_from_yaml(yaml_path)
+    # Get device names and addresses from YAML (pool.map keeps yaml_names order)
+    load_yaml_name_cache()
+    with ThreadPoolExecutor(max_workers=YAML_READ_WORKERS, thread_name_prefix="yaml") as pool:
+        configs = list(pool.map(get_device_config_from_yaml, (ESPHOME_DIR / n for n in yaml_names)))
+    
+    for yaml_name, config in zip(yaml_names, configs):
+        device_name = config.name
         if not device_name:
             log_debug(f"Skipping {yaml_name}: no device name found")
             continue
         
         # Get deployed version from storage file
         deployed_version, _ = get_dashboard_versions(device_name, yaml_name)
+        record_storage_version(yaml_name)
         
         devices.append({
             "name": device_name,
             "config_file": yaml_name,
             "current_version": esphome_version,  # All devices use same ESPHome version
             "deployed_version": deployed_version,
+            "address": config.address,
+            "api_port": config.api_port,
         })
         
         log_debug(f"Device: {device_name} | Config: {yaml_name} | Current: {esphome_version} | Deployed: {deployed_version or 'unknown'}")
     
+    prune_yaml_name_cache(set(yaml_names))
+    save_yaml_name_cache()
     return devices
 
-def get_device_name_from_yaml(yaml_path: Path) -> Optional[str]:
-    """Extract device name from YAML config"""
+# Per-YAML manifest persisted between runs:
+# yaml_name -> {"mtime_ns": int, "size": int, "parser": int, "name": str,
+#               "address": str, "api_port": int, "storage_mtime_ns": int, "deployed": str}
+# Bump YAML_PARSER_VERSION when parsing changes, so entries cached by an older parser are re-read
+YAML_PARSER_VERSION = 4
+_yaml_name_cache: Optional[Dict[str, Dict]] = None
+_yaml_name_cache_dirty = False
+
+_SUBSTITUTION_RE = re.compile(r"\$\{(\w+)\}|\$(\w+)")
+
+# Top-level "key:" followed by its indented (or blank) lines
+_TOP_BLOCK_RE = re.compile(r"^([\w-]+):[^\n]*\n((?:[ \t][^\n]*\n|[ \t]*\n)*)", re.MULTILINE)
+# Indentation of the first non-comment line of a block, i.e. its first level
+_BLOCK_INDENT_RE = re.compile(r"^([ \t]+)[^\s#]", re.MULTILINE)
+# Any name:/device_name: line, used when there is no esphome: name:
+_NAME_RE = re.compile(r"^[ \t]*(?:name|device_name)[ \t]*:(.*)$", re.MULTILINE)
+
+def load_yaml_name_cache() -> Dict[str, Dict]:
+    """Load the persisted YAML name cache (empty if missing or unreadable)"""
+    global _yaml_name_cache
+    if _yaml_name_cache is None:
+        _yaml_name_cache = {}
+        try:
+            with YAML_CACHE_FILE.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                _yaml_name_cache = data
+            # Seed the storage cache so unchanged storage files aren't re-parsed
+            for yaml_name, entry in _yaml_name_cache.items():
+                if "storage_mtime_ns" in entry and yaml_name not in _storage_cache:
+                    deployed = entry.get("deployed")
+                    _storage_cache[yaml_name] = (entry["storage_mtime_ns"], (deployed, deployed))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log_debug(f"Ignoring unreadable YAML cache: {e}")
+    return _yaml_name_cache
+
+def save_yaml_name_cache():
+    """Persist the YAML name cache if it changed during this run"""
+    global _yaml_name_cache_dirty
+    if not _yaml_name_cache_dirty or _yaml_name_cache is None:
+        return
+    try:
+        atomic_write_json(YAML_CACHE_FILE, _yaml_name_cache)
+        _yaml_name_cache_dirty = False
+    except Exception as e:
+        log_debug(f"Failed to save YAML cache: {e}")
+
+def record_storage_version(yaml_name: str):
+    """Copy the storage file's mtime and deployed version into the manifest"""
+    global _yaml_name_cache_dirty
+    entry = load_yaml_name_cache().get(yaml_name)
+    if entry is None:
+        return
+    storage = _storage_cache.get(yaml_name)
+    if storage is None:
+        if "storage_mtime_ns" in entry:
+            del entry["storage_mtime_ns"]
+            entry.pop("deployed", None)
+            _yaml_name_cache_dirty = True
+    elif entry.get("storage_mtime_ns") != storage[0] or entry.get("deployed") != storage[1][0]:
+        entry["storage_mtime_ns"] = storage[0]
+        entry["deployed"] = storage[1][0]
+        _yaml_name_cache_dirty = True
+
+def prune_yaml_name_cache(yaml_names: Set[str]):
+    """Drop cache entries for YAML files that no longer exist"""
+    global _yaml_name_cache_dirty
+    cache = load_yaml_name_cache()
+    for stale in set(cache) - yaml_names:
+        del cache[stale]
+        _yaml_name_cache_dirty = True
+
+def _yaml_scalar(value: str) -> str:
+    """Strip a trailing comment and surrounding quotes from a YAML scalar"""
+    value = value.strip()
+    if value[:1] in ("'", '"'):
+        end = value.find(value[0], 1)
+        if end > 0:
+            return value[1:end]
+    if " #" in value:
+        value = value.split(" #", 1)[0]
+    return value.strip()
+
+class DeviceConfig(NamedTuple):
+    """What the updater needs from a device YAML"""
+    name: Optional[str]
+    address: Optional[str]   # host esphome upload connects to; None if the YAML alone can't tell
+    api_port: Optional[int]  # native API port; None without an api: block
+
+def _top_level_blocks(text: str) -> Dict[str, str]:
+    """Body of each top-level "key:" block (the first occurrence wins)"""
+    blocks: Dict[str, str] = {}
+    for key, body in _TOP_BLOCK_RE.findall(text):
+        blocks.setdefault(key, body)
+    return blocks
+
+# Block patterns depend on the indentation (and key); devices share a handful of these,
+# so each is compiled once per run rather than once per YAML file
+@functools.lru_cache(maxsize=None)
+def _entry_re(indent: str) -> "re.Pattern[str]":
+    """First-level "key: value" lines at the given indentation"""
+    return re.compile(rf"^{re.escape(indent)}([\w-]+)[ \t]*:(.*)$", re.MULTILINE)
+
+@functools.lru_cache(maxsize=None)
+def _nested_block_re(indent: str, key: str) -> "re.Pattern[str]":
+    """A first-level "key:" line at the given indentation and the lines nested under it"""
+    indent = re.escape(indent)
+    return re.compile(rf"^{indent}{re.escape(key)}[ \t]*:[^\n]*\n((?:{indent}[ \t]+[^\n]*\n|[ \t]*\n)*)",
+                      re.MULTILINE)
+
+def _block_entries(body: str) -> Dict[str, str]:
+    """
+    First-level "key: value" entries of an indented block body
+    Deeper keys (e.g. esphome: project: name:) are ignored; the first occurrence wins
+    """
+    m = _BLOCK_INDENT_RE.search(body)
+    if not m:
+        return {}
+    entries: Dict[str, str] = {}
+    for key, value in _entry_re(m.group(1)).findall(body):
+        entries.setdefault(key, value)
+    return entries
+
+def _nested_block(body: str, key: str) -> str:
+    """Lines nested under a first-level key of a block body ("" if there are none)"""
+    m = _BLOCK_INDENT_RE.search(body)
+    if not m:
+        return ""
+    block = _nested_block_re(m.group(1), key).search(body)
+    return block.group(1) if block else ""
+
+def _substitute(value: str, substitutions: Dict[str, str]) -> str:
+    """Resolve ${...} references (they may reference each other, so allow a few passes)"""
+    for _ in range(5):
+        if "$" not in value:
+            break
+        value = _SUBSTITUTION_RE.sub(
+            lambda m: substitutions.get(m.group(1) or m.group(2), m.group(0)), value
+        )
+    return value
+
+def _device_address(blocks: Dict[str, str], name: str, substitutions: Dict[str, str]) -> Optional[str]:
+    """
+    The host esphome upload uses: wifi:/ethernet: use_address, then
+    manual_ip: static_ip, then <name>.local
+    """
+    for network in ("wifi", "ethernet"):
+        if network not in blocks:
+            continue
+        entries = _block_entries(blocks[network])
+        address = _substitute(_yaml_scalar(entries.get("use_address", "")), substitutions)
+        if address:
+            # !secret, !lambda and unresolved substitutions can't be followed from here
+            return None if address.startswith("!") or "$" in address or " " in address else address
+        
+        static_ip = _yaml_scalar(_block_entries(_nested_block(blocks[network], "manual_ip")).get("static_ip", ""))
+        static_ip = _substitute(static_ip, substitutions)
+        if static_ip:
+            try:
+                socket.inet_aton(static_ip)
+            except OSError:
+                return None  # not a literal IPv4 address (e.g. !secret or an unresolved ${...})
+            return static_ip
+    
+    if _yaml_scalar(_block_entries(blocks.get("mdns", "")).get("disabled", "")).lower() == "true":
+        return None
+    return f"{name}.local"
+
+def parse_device_config(text: str) -> DeviceConfig:
+    """
+    Extract the device name and API address from YAML text
+    The name prefers esphome: name:, resolving ${...} against the substitutions:
+    block, and falls back to the first name:/device_name: line in the file.
+    PyYAML is not used: it is not in the image and rejects ESPHome's custom
+    tags (!secret, !include, !lambda).
+    """
+    text += "\n"
+    blocks = _top_level_blocks(text)
+    # Most configs reference no substitutions, so only read the block if something might
+    substitutions = {}
+    if "$" in text and "substitutions" in blocks:
+        substitutions = {key: _yaml_scalar(value)
+                         for key, value in _block_entries(blocks["substitutions"]).items()}
+    
+    name = _yaml_scalar(_block_entries(blocks.get("esphome", "")).get("name", "")) or None
+    if name is None:
+        name = next(filter(None, (_yaml_scalar(v) for v in _NAME_RE.findall(text))), None)
+    if not name:
+        return DeviceConfig(None, None, None)
+    name = _substitute(name, substitutions)
+    
+    api_port = None
+    if "api" in blocks:
+        port = _substitute(_yaml_scalar(_block_entries(blocks["api"]).get("port", "")), substitutions)
+        api_port = int(port) if port.isdigit() else (None if port else ESPHOME_API_PORT)
+    address = _device_address(blocks, name, substitutions) if api_port else None
+    return DeviceConfig(name, address, api_port)
+
+def get_device_config_from_yaml(yaml_path: Path) -> DeviceConfig:
+    """
+    Extract device name and API address from YAML config
+    Results are cached by file mtime and size, so unchanged files are not re-read
+    """
+    global _yaml_name_cache_dirty
+    cache = load_yaml_name_cache()
+    
     try:
-        with yaml_path.open("r", encoding="utf-8") as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith("name:") or line.startswith("device_name:"):
-                    # Handle: name: my-device or name: "my-device"
-                    parts = line.split(":", 1)
-                    if len(parts) == 2:
-                        name = parts[1].strip().strip('"').strip("'")
-                        return name
+        st = yaml_path.stat()
+        mtime, size = st.st_mtime_ns, st.st_size
+        cached = cache.get(yaml_path.name)
+        if (cached and cached.get("mtime_ns") == mtime and cached.get("size") == size
+                and cached.get("parser") == YAML_PARSER_VERSION):
+            return DeviceConfig(cached.get("name"), cached.get("address"), cached.get("api_port"))
+        
+        config = parse_device_config(yaml_path.read_text(encoding="utf-8", errors="ignore"))
     except Exception as e:
         log_debug(f"Error reading {yaml_path.name}: {e}")
-    return None
+        return DeviceConfig(None, None, None)
+    
+    cache[yaml_path.name] = {"mtime_ns": mtime, "size": size, "parser": YAML_PARSER_VERSION,
+                             "name": config.name, "address": config.address, "api_port": config.api_port}
+    _yaml_name_cache_dirty = True
+    return config
 
-def get_current_version(yaml_path: Path) -> Optional[str]:
-    """Get current ESPHome version for a config"""
-    # The path inside the container
-    container_path = f"/config/esphome/{yaml_path.name}"
+# ESPHome version reported by the container, detected once per run
+_esphome_version: Optional[str] = None
+
+def detect_esphome_version() -> Optional[str]:
+    """
+    Get the ESPHome version from the container
+    The version is global to the container, not per config file, so
+    `esphome version` is only run once and the result is reused
+    """
+    global _esphome_version
+    if _esphome_version is not None:
+        return _esphome_version
     
-    returncode, stdout, stderr = run_esphome_command(
-        ["version", container_path]
-    )
+    result = run_esphome_command(["version"], timeout=10)
     
-    if returncode == 0:
+    if result.returncode == 0:
         # Parse version from output
-        for line in stdout.split("\n"):
-            if "Version:" in line:
-                version = line.split("Version:", 1)[1].strip()
-                return version
-    
-    log_debug(f"Could not determine current version for {yaml_path.name}")
+        for line in result.output.split("\n"):
+            if "Version:" in line or "version" in line.lower():
+                version = line.split(":")[-1].strip() if ":" in line else line.strip()
+                # Remove any "Version" prefix
+                version = version.replace("Version", "").replace("version", "").strip()
+                if version and version[0].isdigit():
+                    _esphome_version = version
+                    return version
+    
+    log_debug(f"Could not determine ESPHome version: {result.output.strip()}")
     return None
 
 def compile_device(yaml_path: Path, opts: Dict) -> Tuple[bool, str]:
@@ -497,58 +1267,43 @@ def compile_device(yaml_path: Path, opts: Dict) -> Tuple[bool, str]:
     # because /config is mounted to both
     container_path = f"/config/esphome/{yaml_path.name}"
     
-    returncode, stdout, stderr = run_esphome_command(
+    # Output is logged line by line (debug) as it streams in
+    result = run_esphome_command(
         ["compile", container_path]
     )
+    returncode = result.returncode
     
-    # ALWAYS log compilation output in debug mode
     log_debug(f"Compilation return code: {returncode}")
-    log_debug(f"Compilation stdout:\n{stdout}")
-    log_debug(f"Compilation stderr:\n{stderr}")
     
     # Check for errors first
     if returncode != 0:
         error_msg = "Compilation failed"
-        combined_output = stdout + stderr
+        output = result.output
+        markers = result.markers
         
         # Check for specific error types
-        if "page not found" in combined_output.lower():
+        if "page not found" in markers:
             error_msg = "Docker container error - check ESPHome container is running"
             log_normal(f"  ✗ {error_msg}")
-            log_normal(f"     Docker stderr: {stderr[:200]}")
-        elif "no such file" in combined_output.lower():
+            log_normal(f"     Docker output: {output[-200:]}")
+        elif "no such file" in markers:
             error_msg = f"YAML file not found in container: {container_path}"
             log_normal(f"  ✗ {error_msg}")
-        elif "Error" in combined_output or "ERROR" in combined_output:
-            # Extract ALL error lines, not just the first
-            error_lines = []
-            for line in combined_output.split("\n"):
-                if "ERROR" in line.upper() or "error" in line.lower():
-                    error_lines.append(line.strip())
-            
-            if error_lines:
-                error_msg = error_lines[0]  # Use first error as main message
-                log_normal(f"  ✗ {error_msg}")
-                # Show additional errors if verbose
-                if len(error_lines) > 1:
-                    log_verbose("  Additional errors:")
-                    for err in error_lines[1:5]:  # Show up to 5 errors
-                        log_verbose(f"    - {err}")
-            else:
-                # No specific error found, show raw output
-                log_normal(f"  ✗ Compilation failed")
-                log_normal(f"     Return code: {returncode}")
-                if stderr:
-                    log_normal(f"     Stderr: {stderr[:500]}")
-                if stdout:
-                    log_verbose(f"     Stdout: {stdout[:500]}")
+        elif result.error_lines:
+            # Report ALL error lines, not just the first
+            error_lines = result.error_lines
+            error_msg = error_lines[0]  # Use first error as main message
+            log_normal(f"  ✗ {error_msg}")
+            # Show additional errors if verbose
+            if len(error_lines) > 1:
+                log_verbose("  Additional errors:")
+                for err in error_lines[1:5]:  # Show up to 5 errors
+                    log_verbose(f"    - {err}")
         else:
             # Generic failure - show what we have
             log_normal(f"  ✗ Compilation failed (return code: {returncode})")
-            if stderr:
-                log_normal(f"     Stderr: {stderr[:500]}")
-            if stdout and not stderr:
-                log_normal(f"     Stdout: {stdout[:500]}")
+            if output:
+                log_normal(f"     Output: {output[-500:]}")
         
         if opts.get("stop_on_compilation_error", True):
             return (False, error_msg)
@@ -556,15 +1311,108 @@ def compile_device(yaml_path: Path, opts: Dict) -> Tuple[bool, str]:
             return (False, error_msg)
     
     # Check for warnings
-    combined_output = stdout + stderr
-    if "WARNING" in combined_output.upper():
+    if result.warning_count:
         log_verbose("  ⚠ Compilation produced warnings")
         if opts.get("stop_on_compilation_warning", False):
             return (False, "Compilation warning (stop_on_compilation_warning enabled)")
     
+    # No explicit cache invalidation needed: if ESPHome rewrote the storage
+    # file or dashboard.json, their st_mtime_ns changed and the next read reparses
+    
     log_verbose("  ✓ Compilation successful")
     return (True, "")
 
+_INCLUDE_RE = re.compile(r"!include\s+(?:\{\s*file\s*:\s*)?[\"']?([^\s\"'{},]+)")
+# "- item" lines of a block list
+_LIST_ITEM_RE = re.compile(r"^[ \t]*-[ \t]*(\S[^\n]*)$", re.MULTILINE)
+# external_components: "source: dir" shorthand and "path:" of a type: local source
+_SOURCE_PATH_RE = re.compile(r"^[ \t]*(?:-[ \t]*)?(?:source|path)[ \t]*:[ \t]*(\S[^\n]*)$", re.MULTILINE)
+
+def _local_build_inputs(text: str) -> List[str]:
+    """
+    Local paths a config hands to the build besides !include:
+    esphome: includes: and external_components from a local directory
+    """
+    blocks = _top_level_blocks(text + "\n")
+    esphome = blocks.get("esphome", "")
+    paths: List[str] = []
+    
+    inline = _yaml_scalar(_block_entries(esphome).get("includes", ""))
+    if inline:
+        paths += [_yaml_scalar(item) for item in inline.strip("[]").split(",")]
+    paths += [_yaml_scalar(item) for item in _LIST_ITEM_RE.findall(_nested_block(esphome, "includes"))]
+    
+    for source in _SOURCE_PATH_RE.findall(blocks.get("external_components", "")):
+        source = _yaml_scalar(source)
+        # Remote sources (github://, git URLs) are fetched by ESPHome and can't be checked here
+        if "://" not in source and not source.startswith("github:"):
+            paths.append(source)
+    return [path for path in paths if path]
+
+def config_source_files(yaml_path: Path) -> Set[Path]:
+    """
+    The YAML file plus everything it can pull in locally: secrets.yaml,
+    !include'd files and packages (followed recursively, relative to the
+    including file), and the files under esphome: includes: and local
+    external_components (relative to the device YAML, as ESPHome resolves them)
+    Remote packages and components are not covered.
+    """
+    files = {yaml_path}
+    secrets = ESPHOME_DIR / "secrets.yaml"
+    if secrets.exists():
+        files.add(secrets)
+    
+    pending = [yaml_path]
+    while pending:
+        path = pending.pop()
+        try:
+            text = path.read_text(encoding="utf-8", errors="ignore")
+        except OSError:
+            continue
+        for include in _INCLUDE_RE.findall(text):
+            included = (path.parent / include).resolve()
+            if included not in files:
+                files.add(included)
+                pending.append(included)
+        for build_input in _local_build_inputs(text):
+            source = (yaml_path.parent / build_input).resolve()
+            if source.is_dir():
+                files.update(f for f in source.rglob("*") if f.is_file() and "__pycache__" not in f.parts)
+            else:
+                # A path that doesn't exist fails the mtime check, so the device is compiled
+                files.add(source)
+    return files
+
+def firmware_path(device_name: str) -> Path:
+    """Where ESPHome leaves the firmware for a device's last build"""
+    return ESPHOME_DIR / ".esphome" / "build" / device_name / ".pioenvs" / device_name / "firmware.bin"
+
+def firmware_digest(device_name: str) -> Optional[str]:
+    """SHA-256 of the device's built firmware (None if there is no build)"""
+    try:
+        with firmware_path(device_name).open("rb") as f:
+            return hashlib.file_digest(f, "sha256").hexdigest()
+    except OSError:
+        return None
+
+def binary_is_current(device_name: str, yaml_path: Path) -> bool:
+    """
+    Check if ESPHome's last build of this device can be uploaded as-is:
+    the firmware was built by the running ESPHome version (per the storage
+    file) and is newer than every local source from config_source_files
+    """
+    esphome_version = os.environ.get("ESPHOME_VERSION", "unknown")
+    built_with, _ = get_dashboard_versions(device_name, yaml_path.name)
+    if esphome_version == "unknown" or built_with != esphome_version:
+        return False
+    
+    try:
+        built = firmware_path(device_name).stat().st_mtime_ns
+        return all(path.stat().st_mtime_ns <= built for path in config_source_files(yaml_path))
+    except OSError:
+        # Missing firmware or an include we can't stat: compile to be safe
+        return False
+
 def upload_device(yaml_path: Path, opts: Dict) -> Tuple[bool, str]:
     """
     Upload firmware to device via OTA
@@ -575,32 +1423,26 @@ def upload_device(yaml_path: Path, opts: Dict) -> Tuple[bool, str]:
     # The path inside the container
     container_path = f"/config/esphome/{yaml_path.name}"
     
-    returncode, stdout, stderr = run_esphome_command(
+    result = run_esphome_command(
         ["upload", "--device", "OTA", container_path]
     )
+    returncode = result.returncode
     
     log_debug(f"Upload return code: {returncode}")
-    if stdout:
-        log_debug(f"Upload stdout:\n{stdout}")
-    if stderr:
-        log_debug(f"Upload stderr:\n{stderr}")
     
     if returncode != 0:
         error_msg = "Upload failed"
-        combined_output = stdout + stderr
+        markers = result.markers
         
         # Extract meaningful error
-        if "Connection refused" in combined_output:
+        if "connection refused" in markers:
             error_msg = "Connection refused (device offline or wrong IP?)"
-        elif "timeout" in combined_output.lower():
+        elif "timeout" in markers:
             error_msg = "Upload timeout (device unreachable?)"
-        elif "page not found" in combined_output.lower():
+        elif "page not found" in markers:
             error_msg = "Docker container error - check ESPHome container is running"
-        elif stderr:
-            for line in stderr.split("\n"):
-                if "ERROR" in line.upper() or "Error" in line:
-                    error_msg = line.strip()
-                    break
+        elif result.error_lines:
+            error_msg = result.error_lines[0]
         
         log_normal(f"  ✗ {error_msg}")
         
@@ -618,11 +1460,13 @@ def upload_device(yaml_path: Path, opts: Dict) -> Tuple[bool, str]:
 
 def repair_dashboard_metadata(
     devices: List[Dict],
-    skip_existing: bool = True
+    skip_existing: bool = True,
+    concurrency: int = 1
 ) -> Tuple[int, int]:
     """
     Repair dashboard metadata by compiling devices without OTA upload.
     This populates deployed_version and current_version in dashboard.json.
+    Up to `concurrency` devices (at most one per CPU core) are compiled at the same time.
     
     Returns: (repaired_count, failed_count)
     """
@@ -636,6 +1480,11 @@ def repair_dashboard_metadata(
     else:
         log_normal("Will recompile ALL devices regardless of existing metadata")
     
+    # Repair only compiles, so more parallel compiles than cores just thrash
+    concurrency = min(max(1, int(concurrency)), os.cpu_count() or 1)
+    if concurrency > 1:
+        log_normal(f"Compiling up to {concurrency} devices in parallel")
+    
     log_quiet("")
     
     repaired = 0
@@ -657,6 +1506,7 @@ def repair_dashboard_metadata(
     else:
         log_debug("  Dashboard has no 'devices' array")
     
+    to_compile = []
     for idx, dev in enumerate(devices, start=1):
         name = dev["name"]
         yaml_name = dev["config_file"]
@@ -676,40 +1526,65 @@ def repair_dashboard_metadata(
         if skip_existing:
             log_verbose(f"  → No metadata found, will compile")
         
-        # Compile to generate metadata
-        log_normal(f"  → Compiling {yaml_name} to generate metadata...")
-        yaml_path = ESPHOME_DIR / yaml_name
-        
-        # Use a minimal options dict for compilation (no stopping on errors during repair)
-        repair_opts = {
-            "stop_on_compilation_warning": False,
-            "stop_on_compilation_error": False,
-        }
+        to_compile.append(dev)
+    
+    # Use a minimal options dict for compilation (no stopping on errors during repair)
+    repair_opts = {
+        "stop_on_compilation_warning": False,
+        "stop_on_compilation_error": False,
+    }
+    
+    compiled = []
+    if to_compile:
+        log_quiet("")
+        log_normal(f"Compiling {len(to_compile)} devices to generate metadata...")
         
-        compile_ok, compile_error = compile_device(yaml_path, repair_opts)
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="repair") as executor:
+            futures = {
+                executor.submit(compile_device, ESPHOME_DIR / dev["config_file"], repair_opts): dev
+                for dev in to_compile
+            }
+            try:
+                for done_count, future in enumerate(as_completed(futures), start=1):
+                    dev = futures[future]
+                    try:
+                        compile_ok, compile_error = future.result()
+                    except Exception as e:
+                        compile_ok, compile_error = (False, str(e))
+                    
+                    if compile_ok:
+                        log_normal(f"[{done_count}/{len(to_compile)}] ✓ Compiled {dev['name']}")
+                        compiled.append(dev)
+                    else:
+                        log_normal(f"[{done_count}/{len(to_compile)}] ✗ Compilation failed for {dev['name']}: {compile_error}")
+                        failed += 1
+            except BaseException:
+                # Interrupted (SIGTERM, Ctrl+C): don't start the queued compiles,
+                # and kill the running ones rather than waiting for them
+                executor.shutdown(wait=False, cancel_futures=True)
+                kill_running_commands()
+                raise
+    
+    # Metadata is written from this thread only; anything the compiles changed
+    # on disk is picked up through the mtime-guarded caches
+    
+    # Use the ESPHome version detected at startup
+    esphome_version = os.environ.get("ESPHOME_VERSION", "unknown")
+    
+    for dev in compiled:
+        name = dev["name"]
         
-        if compile_ok:
-            # Use the ESPHome version detected at startup
-            esphome_version = os.environ.get("ESPHOME_VERSION", "unknown")
-            
-            # Write metadata to storage file
-            if esphome_version != "unknown":
-                if update_dashboard_metadata(name, yaml_name, esphome_version):
-                    log_normal(f"  ✓ Metadata generated: deployed={esphome_version}, current={esphome_version}")
-                    repaired += 1
-                else:
-                    log_normal(f"  ⚠ Compiled but failed to update storage file")
-                    failed += 1
+        # Write metadata to storage file
+        if esphome_version != "unknown":
+            if update_dashboard_metadata(name, dev["config_file"], esphome_version):
+                log_verbose(f"  ✓ {name}: metadata generated: deployed={esphome_version}, current={esphome_version}")
+                repaired += 1
             else:
-                log_normal(f"  ⚠ Compiled but ESPHome version unknown")
+                log_normal(f"  ⚠ {name}: compiled but failed to update storage file")
                 failed += 1
         else:
-            log_normal(f"  ✗ Compilation failed: {compile_error}")
+            log_normal(f"  ⚠ {name}: compiled but ESPHome version unknown")
             failed += 1
-        
-        # Small delay between devices
-        if idx < total:
-            time.sleep(0.5)
     
     log_quiet("")
     log_header("Repair Summary")
@@ -725,24 +1600,81 @@ def repair_dashboard_metadata(
 # FILTERING & SELECTION
 # ============================================================================
 
-def matches_pattern(text: str, patterns: List[str]) -> bool:
-    """Check if text matches any of the given patterns"""
-    if not patterns:
+def find_device(devices: List[Dict], key: str) -> Optional[Dict]:
+    """
+    Find a device by exact name, falling back to the first config file
+    starting with key (e.g. "bedroom" for bedroom-light.yaml)
+    """
+    exact = next((dev for dev in devices if dev["name"] == key), None)
+    if exact is not None:
+        return exact
+    return next((dev for dev in devices if dev["config_file"].startswith(key)), None)
+
+def wildcard_to_regex(pattern: str) -> str:
+    """Translate a wildcard pattern: * means any characters, everything else is literal"""
+    return re.escape(pattern).replace(r"\*", ".*")
+
+class PatternSet(NamedTuple):
+    """Compiled name patterns: plain substrings plus one regex for the wildcards"""
+    literals: Tuple[str, ...]
+    regex: Optional["re.Pattern"]
+
+def compile_patterns(patterns: Iterable[str]) -> Optional[PatternSet]:
+    """
+    Compile a list of patterns once: patterns without * are kept as lowercase
+    substrings (a plain `in` check), the rest are fused into one
+    case-insensitive alternation, so each device is checked with one search
+    Returns: the compiled patterns, or None if there are no (non-empty) patterns
+    """
+    literals = tuple(p.lower() for p in patterns if p and "*" not in p)
+    parts = [f"(?:{wildcard_to_regex(p)})" for p in patterns if p and "*" in p]
+    if not literals and not parts:
+        return None
+    regex = re.compile("|".join(parts), re.IGNORECASE) if parts else None
+    return PatternSet(literals, regex)
+
+def matches_pattern(text: str, patterns: Optional[PatternSet]) -> bool:
+    """Check if text matches patterns built by compile_patterns()"""
+    if patterns is None:
         return False
-    
-    for pattern in patterns:
-        if not pattern:
-            continue
-        # Simple wildcard matching: * means any characters
-        regex_pattern = pattern.replace("*", ".*")
-        if re.search(regex_pattern, text, re.IGNORECASE):
+    if patterns.literals:
+        text_lc = text.lower()
+        if any(literal in text_lc for literal in patterns.literals):
             return True
-    
-    return False
+    return patterns.regex is not None and patterns.regex.search(text) is not None
+
+class FilterContext(NamedTuple):
+    """Device filters compiled once per run from the add-on options and progress"""
+    done: Set[str]
+    failed: Set[str]
+    skipped: Set[str]
+    include: Optional[PatternSet]
+    exclude: Optional[PatternSet]
+    yaml_include: Optional[PatternSet]
+    yaml_exclude: Optional[PatternSet]
+    update_when_no_deployed_version: bool
+    update_when_version_matches: bool
+
+def build_filter_context(opts: Dict, progress: Dict) -> FilterContext:
+    """
+    Compile the device and YAML name filters and read the version options once
+    Progress lists become sets here (they stay lists on disk)
+    """
+    return FilterContext(
+        done=set(progress.get("done", ())),
+        failed=set(progress.get("failed", ())),
+        skipped=set(progress.get("skipped", ())),
+        include=compile_patterns(opts.get("device_name_patterns", [])),
+        exclude=compile_patterns(opts.get("skip_device_name_patterns", [])),
+        yaml_include=compile_patterns(opts.get("yaml_name_patterns", [])),
+        yaml_exclude=compile_patterns(opts.get("skip_yaml_name_patterns", [])),
+        update_when_no_deployed_version=bool(opts.get("update_when_no_deployed_version", False)),
+        update_when_version_matches=bool(opts.get("update_when_version_matches", False)),
+    )
 
-def should_process_device(device: Dict, opts: Dict, progress: Dict) -> Tuple[bool, str]:
+def should_process_device(device: Dict, filters: FilterContext) -> Tuple[bool, str]:
     """
-    Determine if a device should be processed
+    Determine if a device should be processed (progress is checked by the caller)
     Returns: (should_process, reason_if_not)
     """
     name = device["name"]
@@ -750,47 +1682,30 @@ def should_process_device(device: Dict, opts: Dict, progress: Dict) -> Tuple[boo
     current = device["current_version"]
     deployed = device["deployed_version"]
     
-    # Check if already processed
-    if name in progress.get("done", []):
-        return (False, "already processed (in done list)")
-    
-    if name in progress.get("failed", []):
-        return (False, "previously failed (in failed list)")
+    # Version-based logic (cheap string checks, and the most common reason
+    # to skip, so they run before the pattern searches)
+    if not deployed:
+        if not filters.update_when_no_deployed_version:
+            return (False, "no deployed version (update_when_no_deployed_version=false)")
     
-    if name in progress.get("skipped", []):
-        return (False, "previously skipped (in skipped list)")
+    if current and deployed and current == deployed:
+        if not filters.update_when_version_matches:
+            return (False, f"versions match ({current})")
     
     # Device name filtering
-    include_patterns = opts.get("device_name_patterns", [])
-    exclude_patterns = opts.get("skip_device_name_patterns", [])
+    if filters.include is not None and not matches_pattern(name, filters.include):
+        return (False, f"device name doesn't match include patterns")
     
-    if include_patterns:
-        if not matches_pattern(name, include_patterns):
-            return (False, f"device name doesn't match include patterns")
-    
-    if matches_pattern(name, exclude_patterns):
+    if matches_pattern(name, filters.exclude):
         return (False, f"device name matches exclude pattern")
     
     # YAML name filtering
-    yaml_include = opts.get("yaml_name_patterns", [])
-    yaml_exclude = opts.get("skip_yaml_name_patterns", [])
-    
-    if yaml_include:
-        if not matches_pattern(config, yaml_include):
-            return (False, f"config file doesn't match include patterns")
+    if filters.yaml_include is not None and not matches_pattern(config, filters.yaml_include):
+        return (False, f"config file doesn't match include patterns")
     
-    if matches_pattern(config, yaml_exclude):
+    if matches_pattern(config, filters.yaml_exclude):
         return (False, f"config file matches exclude pattern")
     
-    # Version-based logic
-    if not deployed:
-        if not opts.get("update_when_no_deployed_version", False):
-            return (False, "no deployed version (update_when_no_deployed_version=false)")
-    
-    if current and deployed and current == deployed:
-        if not opts.get("update_when_version_matches", False):
-            return (False, f"versions match ({current})")
-    
     return (True, "")
 
 def filter_devices(devices: List[Dict], opts: Dict, progress: Dict) -> List[Dict]:
@@ -801,17 +1716,43 @@ def filter_devices(devices: List[Dict], opts: Dict, progress: Dict) -> List[Dict
     log_normal(f"Total devices found: {total}")
     
     filtered = []
-    skip_reasons = {}
+    skip_reasons: collections.Counter = collections.Counter()
+    filters = build_filter_context(opts, progress)
     
+    # Devices already recorded in progress are counted rather than logged one
+    # by one, so a mostly-finished resumed run doesn't repeat its whole history
+    pending = []
     for device in devices:
-        should_process, reason = should_process_device(device, opts, progress)
+        name = device["name"]
+        if name in filters.done:
+            skip_reasons["already processed (in done list)"] += 1
+        elif name in filters.failed:
+            skip_reasons["previously failed (in failed list)"] += 1
+        elif name in filters.skipped:
+            skip_reasons["previously skipped (in skipped list)"] += 1
+        else:
+            pending.append(device)
+    
+    if len(pending) < total:
+        log_normal(f"Already handled in previous runs: {total - len(pending)}")
+    
+    for device in pending:
+        should_process, reason = should_process_device(device, filters)
         
         if should_process:
             filtered.append(device)
             log_verbose(f"✓ {device['name']} - will process")
         else:
             log_verbose(f"✗ {device['name']} - {reason}")
-            skip_reasons[reason] = skip_reasons.get(reason, 0) + 1
+            skip_reasons[reason] += 1
+    
+    if filtered and opts.get("skip_offline_devices", False):
+        filtered, offline = split_online_devices(filtered)
+        for device in offline:
+            log_verbose(f"✗ {device['name']} - offline (no answer on {device['address']}:{device['api_port']})")
+        if offline:
+            log_normal(f"Devices offline: {len(offline)}")
+            skip_reasons["offline"] = len(offline)
     
     log_normal(f"Devices to process: {len(filtered)}")
     log_normal(f"Devices skipped: {total - len(filtered)}")
@@ -819,144 +1760,231 @@ def filter_devices(devices: List[Dict], opts: Dict, progress: Dict) -> List[Dict
     if skip_reasons:
         log_verbose("")
         log_verbose("Skip reasons:")
-        for reason, count in sorted(skip_reasons.items(), key=lambda x: -x[1]):
+        for reason, count in skip_reasons.most_common():
             log_verbose(f"  - {reason}: {count}")
     
     return filtered
 
+# ============================================================================
+# DEVICE REACHABILITY
+# ============================================================================
+
+ESPHOME_API_PORT = 6053
+PROBE_TIMEOUT = 2.0
+# The socket timeout doesn't cover the host name lookup (e.g. a slow .local
+# resolution), so each round of probes is also given an overall deadline
+PROBE_DEADLINE = 2 * PROBE_TIMEOUT
+# Probes are almost entirely waiting (mDNS lookup, TCP connect), so use plenty of
+# threads: a whole fleet is checked in a few timeout windows, not one per device
+PROBE_WORKERS = 64
+
+def probe_device(address: str, port: int, timeout: float = PROBE_TIMEOUT) -> bool:
+    """Check if a device accepts a TCP connection on its ESPHome API port"""
+    try:
+        with socket.create_connection((address, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+def split_online_devices(devices: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Probe all devices at once, on the address and API port from their YAML,
+    so offline devices can be skipped before spending time compiling them
+    Devices that can't be probed (no api:, address from !secret, mDNS
+    disabled) are kept; a probe still running at the deadline counts as offline
+    Returns: (online devices, offline devices), each in the original order
+    """
+    probed = [d for d in devices if d.get("address") and d.get("api_port")]
+    if len(probed) < len(devices):
+        log_verbose(f"{len(devices) - len(probed)} devices have no API address to check, keeping them")
+    if not probed:
+        return (list(devices), [])
+    log_normal(f"Checking which of {len(probed)} devices are online...")
+    
+    pool = ThreadPoolExecutor(max_workers=min(PROBE_WORKERS, len(probed)), thread_name_prefix="probe")
+    futures = [pool.submit(probe_device, d["address"], d["api_port"]) for d in probed]
+    rounds = -(-len(probed) // PROBE_WORKERS)
+    try:
+        wait_for_futures(futures, timeout=PROBE_DEADLINE * rounds)
+    finally:
+        # Don't wait for name lookups that are still stuck; they finish on their own
+        pool.shutdown(wait=False, cancel_futures=True)
+    
+    offline_ids = {id(d) for d, future in zip(probed, futures)
+                   if not (future.done() and not future.cancelled() and future.result())}
+    online = [d for d in devices if id(d) not in offline_ids]
+    offline = [d for d in devices if id(d) in offline_ids]
+    return (online, offline)
+
 # ============================================================================
 # DEVICE PROCESSING
 # ============================================================================
 
-def process_devices(devices: List[Dict], opts: Dict, progress: Dict):
-    """Process (compile and upload) filtered devices"""
-    if not devices:
-        log_normal("")
-        log_normal("No devices to process.")
+def last_uploaded_digest(progress: Dict, progress_lock: threading.Lock, name: str) -> Optional[str]:
+    """SHA-256 of the firmware last uploaded to a device (recorded with skip_upload_when_unchanged)"""
+    with progress_lock:
+        return progress.get("hashes", {}).get(name)
+
+def run_device_jobs(devices: List[Dict], process_one, concurrency: int, stop: threading.Event):
+    """
+    Call process_one(idx, device) for every device, one at a time or on a
+    thread pool; once stop is set, no further devices are started
+    If this thread is interrupted (SIGTERM, Ctrl+C), queued devices are
+    cancelled and the running devices' ESPHome commands are killed, so the
+    workers finish (recording those devices as failed, to be retried next
+    run) without waiting for a long compile or upload
+    """
+    if concurrency <= 1:
+        for idx, device in enumerate(devices, start=1):
+            process_one(idx, device)
+            if stop.is_set():
+                break
         return
     
-    log_header("Processing Devices")
-    
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="update") as pool:
+        futures = [pool.submit(process_one, idx, device)
+                   for idx, device in enumerate(devices, start=1)]
+        try:
+            for future in as_completed(futures):
+                future.result()
+        except BaseException:
+            stop.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+            kill_running_commands()
+            raise
+
+def update_devices(devices: List[Dict], opts: Dict, progress: Dict, compile_first: bool):
+    """
+    Upload each device, compiling it first when compile_first is set (upload-only
+    mode reuses the existing build), and record the outcome in progress
+    With update_concurrency > 1, several devices are updated at once (with no
+    more compiles than CPU cores); a stop_on_* error stops new devices from
+    starting, while devices already in progress are allowed to finish
+    """
     total = len(devices)
     dry_run = opts.get("dry_run", False)
+    concurrency = max(1, int(opts.get("update_concurrency", 1)))
+    compile_slots_count = min(concurrency, os.cpu_count() or 1)
+    skip_current_binaries = opts.get("skip_compile_when_binary_current", False)
+    skip_unchanged_uploads = opts.get("skip_upload_when_unchanged", False)
+    stop_on_compilation_error = opts.get("stop_on_compilation_error", True)
+    stop_on_upload_error = opts.get("stop_on_upload_error", True)
     
     if dry_run:
-        log_normal("DRY RUN MODE - No actual compilation or upload will occur")
+        log_normal(f"DRY RUN MODE - No actual {'compilation or upload' if compile_first else 'uploads'} will occur")
         log_normal("")
+    elif concurrency > 1 and compile_first:
+        log_normal(f"Updating up to {concurrency} devices at a time ({compile_slots_count} compiling at once)")
+    elif concurrency > 1:
+        log_normal(f"Uploading to up to {concurrency} devices at a time")
+    
+    stop = threading.Event()
+    # Serializes progress updates and dashboard metadata writes between workers
+    progress_lock = threading.Lock()
+    # Compiles are CPU-bound, uploads are not: cap compiles at the core count so
+    # extra workers spend their time uploading finished binaries instead
+    compile_slots = threading.BoundedSemaphore(compile_slots_count)
+    
+    def record(name: str, outcome: str, stop_message: Optional[str] = None):
+        """Add the device to progress[outcome]; a stop_message also stops new devices"""
+        with progress_lock:
+            progress[outcome].append(name)
+            save_progress(progress)
+        if stop_message and not stop.is_set():
+            stop.set()
+            log_normal("")
+            log_normal(stop_message)
+    
+    def compile_step(name: str, yaml_path: Path) -> bool:
+        if skip_current_binaries and binary_is_current(name, yaml_path):
+            log_normal("  → Existing binary is up to date, skipping compilation")
+            return True
+        with compile_slots:
+            compile_ok, compile_error = compile_device(yaml_path, opts)
+        if not compile_ok:
+            log_normal(f"  ✗ Compilation failed for {name}: {compile_error}")
+            record(name, "failed", "Stopping due to compilation error (stop_on_compilation_error=true)"
+                   if stop_on_compilation_error else None)
+        return compile_ok
     
-    for idx, device in enumerate(devices, start=1):
+    def process_one(idx: int, device: Dict):
+        if stop.is_set():
+            return
+        
         name = device["name"]
         config = device["config_file"]
-        current = device["current_version"]
-        deployed = device["deployed_version"]
         
         log_normal("")
-        log_normal(f"[{idx}/{total}] Processing: {name}")
+        log_normal(f"[{idx}/{total}] {'Processing' if compile_first else 'Uploading'}: {name}")
         log_verbose(f"  Config: {config}")
-        log_verbose(f"  Versions: deployed={deployed or 'unknown'}, current={current or 'unknown'}")
+        if compile_first:
+            log_verbose(f"  Versions: deployed={device['deployed_version'] or 'unknown'}, "
+                        f"current={device['current_version'] or 'unknown'}")
         
         yaml_path = ESPHOME_DIR / config
         
         if dry_run:
-            log_normal("  → [DRY RUN] Would compile and upload")
-            progress["done"].append(name)
-            save_progress(progress)
-            continue
-        
-        # Compile
-        compile_ok, compile_error = compile_device(yaml_path, opts)
-        if not compile_ok:
-            log_normal(f"  ✗ Compilation failed: {compile_error}")
-            progress["failed"].append(name)
-            save_progress(progress)
-            
-            if opts.get("stop_on_compilation_error", True):
-                log_normal("")
-                log_normal("Stopping due to compilation error (stop_on_compilation_error=true)")
-                break
-            continue
-        
-        # Upload
-        upload_ok, upload_error = upload_device(yaml_path, opts)
+            log_normal("  → [DRY RUN] Would " + ("compile and upload" if compile_first else "upload pre-compiled binary"))
+            record(name, "done")
+            return
+        
+        if compile_first and not compile_step(name, yaml_path):
+            return
+        
+        # Upload (unless this exact firmware was the last one uploaded, when enabled)
+        digest = firmware_digest(name) if skip_unchanged_uploads else None
+        if digest is not None and last_uploaded_digest(progress, progress_lock, name) == digest:
+            log_normal("  → Firmware unchanged since the last upload, skipping upload")
+            upload_ok, upload_error = True, ""
+        else:
+            if not compile_first:
+                log_normal("  → Uploading to device (using existing binary)...")
+            upload_ok, upload_error = upload_device(yaml_path, opts)
         if not upload_ok:
-            log_normal(f"  ✗ Upload failed: {upload_error}")
-            progress["failed"].append(name)
-            save_progress(progress)
-            
-            if opts.get("stop_on_upload_error", True):
-                log_normal("")
-                log_normal("Stopping due to upload error (stop_on_upload_error=true)")
-                break
-            continue
+            log_normal(f"  ✗ Upload failed for {name}: {upload_error}")
+            record(name, "failed", "Stopping due to upload error (stop_on_upload_error=true)"
+                   if stop_on_upload_error else None)
+            return
         
         # Success
-        log_normal(f"  ✓ Successfully updated {name}")
+        log_normal(f"  ✓ Successfully {'updated' if compile_first else 'uploaded'} {name}")
         
-        # Update storage metadata
-        esphome_version = os.environ.get("ESPHOME_VERSION", "unknown")
-        if esphome_version != "unknown":
-            update_dashboard_metadata(name, config, esphome_version)
-        
-        progress["done"].append(name)
-        save_progress(progress)
+        with progress_lock:
+            if digest is not None:
+                progress.setdefault("hashes", {})[name] = digest
+            # Update storage metadata
+            esphome_version = os.environ.get("ESPHOME_VERSION", "unknown")
+            if esphome_version != "unknown":
+                update_dashboard_metadata(name, config, esphome_version)
+            
+            progress["done"].append(name)
+            save_progress(progress)
+    
+    run_device_jobs(devices, process_one, 1 if dry_run else concurrency, stop)
+    flush_progress()
 
-def process_devices_upload_only(devices: List[Dict], opts: Dict, progress: Dict):
-    """Process devices with upload only (skip compilation)"""
+def process_devices(devices: List[Dict], opts: Dict, progress: Dict):
+    """Process (compile and upload) filtered devices"""
     if not devices:
         log_normal("")
         log_normal("No devices to process.")
         return
     
-    log_header("Uploading Pre-Compiled Binaries")
-    
-    total = len(devices)
-    dry_run = opts.get("dry_run", False)
-    
-    if dry_run:
-        log_normal("DRY RUN MODE - No actual uploads will occur")
+    log_header("Processing Devices")
+    update_devices(devices, opts, progress, compile_first=True)
+
+def process_devices_upload_only(devices: List[Dict], opts: Dict, progress: Dict):
+    """
+    Process devices with upload only (skip compilation)
+    Uses update_concurrency like normal mode
+    """
+    if not devices:
         log_normal("")
+        log_normal("No devices to process.")
+        return
     
-    for idx, device in enumerate(devices, start=1):
-        name = device["name"]
-        config = device["config_file"]
-        
-        log_normal("")
-        log_normal(f"[{idx}/{total}] Uploading: {name}")
-        log_verbose(f"  Config: {config}")
-        
-        yaml_path = ESPHOME_DIR / config
-        
-        if dry_run:
-            log_normal("  → [DRY RUN] Would upload pre-compiled binary")
-            progress["done"].append(name)
-            save_progress(progress)
-            continue
-        
-        # Upload only (no compilation)
-        log_normal(f"  → Uploading to device (using existing binary)...")
-        upload_ok, upload_error = upload_device(yaml_path, opts)
-        
-        if not upload_ok:
-            log_normal(f"  ✗ Upload failed: {upload_error}")
-            progress["failed"].append(name)
-            save_progress(progress)
-            
-            if opts.get("stop_on_upload_error", True):
-                log_normal("")
-                log_normal("Stopping due to upload error (stop_on_upload_error=true)")
-                break
-            continue
-        
-        # Success
-        log_normal(f"  ✓ Successfully uploaded {name}")
-        
-        # Update storage metadata
-        esphome_version = os.environ.get("ESPHOME_VERSION", "unknown")
-        if esphome_version != "unknown":
-            update_dashboard_metadata(name, config, esphome_version)
-        
-        progress["done"].append(name)
-        save_progress(progress)
+    log_header("Uploading Pre-Compiled Binaries")
+    update_devices(devices, opts, progress, compile_first=False)
 
 # ============================================================================
 # SUMMARY & REPORTING
@@ -1001,6 +2029,8 @@ def main():
     # Load configuration
     opts = load_options()
     state = load_state()
+    atexit.register(state.flush)
+    atexit.register(flush_progress)
     progress = load_progress()
     
     # Set log level FIRST before any logging
@@ -1014,7 +2044,7 @@ def main():
     log_normal(f"Log level: {opts.get('log_level', 'normal')}")
     
     # Verify ESPHome container is accessible
-    esphome_container = os.environ.get("ESPHOME_CONTAINER", "")
+    esphome_container = ESPHOME_CONTAINER
     if not esphome_container:
         log_quiet("")
         log_quiet("ERROR: ESPHOME_CONTAINER environment variable not set")
@@ -1026,42 +2056,53 @@ def main():
     # Test Docker connectivity
     log_verbose("Testing Docker connectivity...")
     try:
-        result = subprocess.run(
-            ["docker", "ps", "--filter", f"name={esphome_container}", "--format", "{{.Names}}"],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        if result.returncode != 0:
-            log_quiet("")
-            log_quiet(f"ERROR: Cannot communicate with Docker daemon")
-            log_quiet(f"Docker error: {result.stderr}")
-            sys.exit(1)
+        # One request on the Docker socket; docker ps is only the fallback
+        running = docker_container_running(esphome_container)
         
-        if esphome_container not in result.stdout:
+        if running is False:
             log_quiet("")
             log_quiet(f"ERROR: ESPHome container '{esphome_container}' is not running")
-            log_quiet(f"Running containers: {result.stdout.strip()}")
             log_quiet("Please start the ESPHome add-on first")
             sys.exit(1)
         
+        if running is None:
+            result = subprocess.run(
+                ["docker", "ps", "--filter", f"name={esphome_container}", "--format", "{{.Names}}"],
+                capture_output=True,
+                text=True,
+                timeout=10
+            )
+            if result.returncode != 0:
+                log_quiet("")
+                log_quiet(f"ERROR: Cannot communicate with Docker daemon")
+                log_quiet(f"Docker error: {result.stderr}")
+                sys.exit(1)
+            
+            if esphome_container not in result.stdout:
+                log_quiet("")
+                log_quiet(f"ERROR: ESPHome container '{esphome_container}' is not running")
+                log_quiet(f"Running containers: {result.stdout.strip()}")
+                log_quiet("Please start the ESPHome add-on first")
+                sys.exit(1)
+        
         log_verbose(f"✓ Docker connectivity verified")
         
         # Find the esphome executable in the container
         log_verbose("Detecting ESPHome executable location...")
         
-        # Try common locations
+        # Try common locations (run directly, no shell needed)
         esphome_paths = [
-            "which esphome",
-            "ls /usr/local/bin/esphome",
-            "ls /usr/bin/esphome", 
-            "python3 -c 'import esphome; print(esphome.__file__)'",
+            ["which", "esphome"],
+            ["ls", "/usr/local/bin/esphome"],
+            ["ls", "/usr/bin/esphome"],
+            ["python3", "-c", "import esphome; print(esphome.__file__)"],
         ]
         
         esphome_found = False
+        exec_error = ""
         for path_cmd in esphome_paths:
             check_result = subprocess.run(
-                ["docker", "exec", esphome_container, "sh", "-c", path_cmd],
+                ["docker", "exec", esphome_container, *path_cmd],
                 capture_output=True,
                 text=True,
                 timeout=10
@@ -1071,13 +2112,14 @@ def main():
                 esphome_found = True
                 
                 # Store the working command for later use
-                if "which" in path_cmd:
+                if path_cmd[0] == "which":
                     os.environ["ESPHOME_COMMAND"] = "esphome"
-                elif "python3" in path_cmd:
+                elif path_cmd[0] == "python3":
                     os.environ["ESPHOME_COMMAND"] = "python3 -m esphome"
                 else:
                     os.environ["ESPHOME_COMMAND"] = check_result.stdout.strip()
                 break
+            exec_error = check_result.stderr.strip() or exec_error
         
         if not esphome_found:
             log_quiet("")
@@ -1085,32 +2127,20 @@ def main():
             log_quiet(f"Container: {esphome_container}")
             log_quiet("Tried locations:")
             for p in esphome_paths:
-                log_quiet(f"  - {p}")
+                log_quiet(f"  - {' '.join(p)}")
+            if exec_error:
+                log_quiet(f"Last docker exec error: {exec_error}")
             log_quiet("")
-            log_quiet("This might be an incompatible ESPHome container version.")
+            log_quiet("This might be an incompatible ESPHome container version,")
+            log_quiet("or commands can't be executed in the container.")
             sys.exit(1)
         
         # Get ESPHome version and store globally
         log_verbose("Detecting ESPHome version...")
-        esphome_cmd = os.environ.get("ESPHOME_COMMAND", "esphome")
-        version_result = subprocess.run(
-            ["docker", "exec", esphome_container] + esphome_cmd.split() + ["version"],
-            capture_output=True,
-            text=True,
-            timeout=10
-        )
-        
-        if version_result.returncode == 0:
-            # Parse version from output
-            for line in version_result.stdout.split("\n"):
-                if "Version:" in line or "version" in line.lower():
-                    version = line.split(":")[-1].strip() if ":" in line else line.strip()
-                    # Remove any "Version" prefix
-                    version = version.replace("Version", "").replace("version", "").strip()
-                    if version and version[0].isdigit():
-                        os.environ["ESPHOME_VERSION"] = version
-                        log_verbose(f"✓ ESPHome version: {version}")
-                        break
+        version = detect_esphome_version()
+        if version:
+            os.environ["ESPHOME_VERSION"] = version
+            log_verbose(f"✓ ESPHome version: {version}")
         
         if "ESPHOME_VERSION" not in os.environ:
             log_quiet("")
@@ -1151,11 +2181,7 @@ def main():
         set_log_level("debug")
         
         # Find the device
-        target = None
-        for dev in devices:
-            if dev["name"] == test_device or dev["config_file"].startswith(test_device):
-                target = dev
-                break
+        target = find_device(devices, test_device)
         
         if not target:
             log_quiet(f"ERROR: Device '{test_device}' not found")
@@ -1212,7 +2238,11 @@ def main():
         log_normal("")
         
         # In repair mode, always skip existing metadata
-        repaired, failed = repair_dashboard_metadata(devices, skip_existing=True)
+        repaired, failed = repair_dashboard_metadata(
+            devices,
+            skip_existing=True,
+            concurrency=opts.get("repair_concurrency", 2)
+        )
         
         # Restore original log level
         set_log_level(opts.get("log_level", "normal"))
@@ -1272,9 +2302,24 @@ def main():
     # Print summary
     print_summary(devices, filtered_devices, progress, opts)
 
+def handle_sigterm(signum, frame):
+    """
+    Turn SIGTERM (add-on stop) into a normal exit so atexit handlers flush
+    Nothing is logged here: the signal can arrive while this thread holds
+    _log_lock, so the message is logged once the exit has unwound
+    """
+    sys.exit(143)
+
 if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, handle_sigterm)
     try:
         main()
+    except SystemExit as e:
+        if e.code == 143:
+            kill_running_commands()
+            log_quiet("")
+            log_quiet("Received SIGTERM, stopping")
+        raise
     except KeyboardInterrupt:
         log_quiet("")
         log_quiet("Interrupted by user")